@@ -60,6 +60,7 @@ if __name__ == '__main__':
             'packaging',
             'requests',
             'six',
+            'urllib3',
         ],
 
         python_requires='>=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*, !=3.4.*, !=3.5.*',
@@ -0,0 +1,436 @@
+"""Tests for the vendor AWS Lambda handler."""
+import contextlib
+import importlib
+import io
+import json
+import os.path
+import re
+import subprocess
+import sys
+import tarfile
+import time
+
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+import pytest
+
+# The handler reads its configuration at import.
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('BUCKET', 'packages')
+os.environ.setdefault('BUILD_PROXY_AMI', 'ami-12345678')
+os.environ.setdefault('BUILD_PROXY_PROFILE', 'build-proxy')
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'vendor', 'aws', 'vendor'))
+handler = importlib.import_module('handler')
+
+# Older botocore, as on the Lambda runtimes, rejects IfNoneMatch even when stubbed
+requires_conditional_put = pytest.mark.skipif(
+    not handler.supports_conditional_put(handler.s3_client),
+    reason='botocore does not support conditional PUT',
+)
+
+# Filename patterns used before the source and wheel patterns were combined
+SRC_RE = re.compile(
+    r'(?P<distribution>[^-]+)-(?P<version>[^-]+)'
+    r'(?P<ext>\.tar\.[bgx]z|\.zip)'
+)
+WHL_RE = re.compile(
+    r'(?P<distribution>[^-]+)-(?P<version>[^-]+)'
+    r'(-(?P<build>\d[^-]*))?'
+    r'-(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)'
+    r'(?P<ext>\.whl)'
+)
+
+
+def two_regex_parse(filename):
+    """Parse filename as PackageInfo.parse did with separate patterns."""
+    for rgx in (SRC_RE, WHL_RE):
+        match = rgx.match(filename)
+        if match:
+            kw = match.groupdict()
+            kw['distribution'] = kw['distribution'].replace('_', '-')
+            kw['version'] = kw['version'].replace('_', '-')
+            return handler.PackageInfo(**kw)
+
+    raise handler.ParseError('Unable to parse filename: ' + filename)
+
+
+def test_parse_package_info():
+    """Test PackageInfo.parse matches the separate source and wheel patterns."""
+    filenames = [
+        'requests-2.18.4.tar.gz',
+        'lxml-4.1.1.tar.xz',
+        'six-1.11.0.zip',
+        'zope.interface-4.4.3.tar.gz',
+        'six-1.11.0-py2.py3-none-any.whl',
+        'numpy-1.13.3-cp36-cp36m-manylinux1_x86_64.whl',
+        'typing_extensions-3.6.2.1-py3-none-any.whl',
+        'foo-1.0-1-py3-none-any.whl',
+        'foo-1.0-2b-cp27-cp27mu-linux_x86_64.whl',
+    ]
+    for filename in filenames:
+        info = handler.PackageInfo.parse(filename)
+        assert vars(info) == vars(two_regex_parse(filename)), filename
+
+
+def test_parse_package_info_rejected():
+    """Test PackageInfo.parse rejects names that are not artifacts."""
+    for filename in ['README', 'foo.whl', 'foo-1.0.exe', 'foo-1.0-py3-none.whl']:
+        with pytest.raises(handler.ParseError):
+            two_regex_parse(filename)
+        with pytest.raises(handler.ParseError):
+            handler.PackageInfo.parse(filename)
+
+    # The combined pattern is anchored, so trailing text is no longer ignored.
+    with pytest.raises(handler.ParseError):
+        handler.PackageInfo.parse('foo-1.0.tar.gz.asc')
+
+
+def test_parse_package_info_bz2():
+    """Test .tar.bz2 sources keep their full extension."""
+    info = handler.PackageInfo.parse('pycrypto-2.6.1.tar.bz2')
+    assert (info.distribution, info.version, info.ext) == ('pycrypto', '2.6.1', '.tar.bz2')
+    assert info.is_src()
+
+
+def test_run_pip_in_process(monkeypatch):
+    """Test in-process pip is given the args, and a failure status raises."""
+    calls = []
+    statuses = [0, 2]
+
+    def pip_main(args):
+        calls.append(args)
+        return statuses.pop(0)
+
+    monkeypatch.setattr(handler, 'PIP_IN_PROCESS', True)
+    monkeypatch.setattr(handler, 'load_pip_main', lambda: pip_main)
+    handler.run_pip(['download', 'a'])
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        handler.run_pip(['download', 'b'])
+
+    assert calls == [['download', 'a'], ['download', 'b']]
+    assert excinfo.value.returncode == 2
+    assert excinfo.value.cmd == ['pip', 'download', 'b']
+
+
+def test_save_pip_cache(tmpdir, monkeypatch):
+    """Test the pip cache is saved only if changed and within the size cap."""
+    cdir = tmpdir.mkdir('cache')
+    cdir.join('a').write('data')
+    monkeypatch.setattr(handler, '_pip_cache_files', {'a'})
+    monkeypatch.setattr(handler, '_pip_cache_saved', 0)
+    with Stubber(handler.s3_client) as stubber:
+        handler.save_pip_cache(str(cdir), 'packages')  # Unchanged
+        cdir.join('b').write('data')
+        monkeypatch.setattr(handler, 'PIP_CACHE_MAX_SIZE', 7)
+        handler.save_pip_cache(str(cdir), 'packages')  # Too large
+        assert handler._pip_cache_files == {'a'}
+
+        monkeypatch.setattr(handler, 'PIP_CACHE_MAX_SIZE', 8)
+        stubber.add_response('put_object', {})
+        handler.save_pip_cache(str(cdir), 'packages')
+        stubber.assert_no_pending_responses()
+
+    assert handler._pip_cache_files == {'a', 'b'}
+
+
+def test_save_pip_cache_interval(tmpdir, monkeypatch, caplog):
+    """Test a changed pip cache is not saved again within the save interval."""
+    cdir = tmpdir.mkdir('cache')
+    cdir.join('a').write('data')
+    monkeypatch.setattr(handler, '_pip_cache_files', set())
+    monkeypatch.setattr(handler, '_pip_cache_saved', time.time())
+    with Stubber(handler.s3_client) as stubber:
+        handler.save_pip_cache(str(cdir), 'packages')
+        assert handler._pip_cache_files == set()
+
+        monkeypatch.setattr(handler, '_pip_cache_saved', time.time() - handler.PIP_CACHE_SAVE_INTERVAL)
+        stubber.add_response('put_object', {})
+        handler.save_pip_cache(str(cdir), 'packages')
+        stubber.assert_no_pending_responses()
+
+    assert handler._pip_cache_files == {'a'}
+    assert 'Unable to save pip cache' not in caplog.text
+
+
+def cache_archive(*names):
+    """Return a streaming pip cache archive containing files names."""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w') as tar:
+        for name in names:
+            member = tarfile.TarInfo(name)
+            member.size = 4
+            tar.addfile(member, io.BytesIO(b'data'))
+
+    data = buf.getvalue()
+    return StreamingBody(io.BytesIO(data), len(data))
+
+
+@pytest.mark.parametrize('names, expected', [
+    (['./http/a', './wheels/b'], {'http/a', 'wheels/b'}),
+    (['./http/a', '../evil'], set()),
+    (['/etc/evil'], set()),
+])
+def test_restore_pip_cache(tmpdir, monkeypatch, names, expected):
+    """Test the pip cache is restored, unless the archive has unsafe members."""
+    monkeypatch.setattr(handler, '_pip_cache_files', None)
+    cdir = str(tmpdir.mkdir('cache'))
+    with Stubber(handler.s3_client) as stubber:
+        stubber.add_response(
+            'get_object',
+            {'Body': cache_archive(*names)},
+            {'Bucket': 'packages', 'Key': handler.PIP_CACHE_KEY},
+        )
+        handler.restore_pip_cache(cdir, 'packages')
+
+    assert handler._pip_cache_files == expected
+    assert not tmpdir.join('evil').check()
+
+
+def test_check_cache_member():
+    """Test links are refused in the pip cache archive."""
+    member = tarfile.TarInfo('./http/link')
+    member.type = tarfile.SYMTYPE
+    member.linkname = '/etc/passwd'
+    with pytest.raises(ValueError):
+        handler.check_cache_member(member)
+
+
+def test_find_route():
+    """Test routes are found by longest prefix, as sorted prefix matching did."""
+    resources = [
+        '/version',
+        '/versions',
+        '/3/vend/{requirements}',
+        '/2/vend/{requirements+}',
+        '/4/vend/{requirements}',
+        '/',
+        '',
+    ]
+    routes = {
+        '/version': handler.version,
+        '/3/vend': handler.vend,
+        '/2/vend': handler.vend,
+    }
+    for resource in resources:
+        expected = None
+        for route in reversed(sorted(routes)):
+            if resource.startswith(route):
+                expected = routes[route]
+                break
+
+        assert handler.apiproxy._find_route(resource) is expected, resource
+
+
+def test_dispatch_not_found():
+    """Test dispatch responds 404 for unknown resources."""
+    response = handler.dispatch({'resource': '/nope'}, None)
+    assert response['statusCode'] == 404
+    assert json.loads(response['body'])['resource'] == '/nope'
+
+
+def fake_vend_io(monkeypatch, *filenames):
+    """Replace vend's downloads and uploads with filenames, uploaded under their keys."""
+    @contextlib.contextmanager
+    def download_packages(requirements):
+        yield [os.path.join('/tmp/dl', filename) for filename in filenames]
+
+    def upload_artifacts(artifacts, bucketname, overwrite):
+        for artifact in artifacts:
+            yield artifact.info.distribution + '/' + artifact.filename, artifact
+
+    monkeypatch.setattr(handler, 'download_packages', download_packages)
+    monkeypatch.setattr(handler, 'upload_artifacts', upload_artifacts)
+
+
+def test_vend_launches_builds(monkeypatch):
+    """Test vend launches a build for each source artifact."""
+    fake_vend_io(monkeypatch, 'foo-1.0.tar.gz', 'bar-2.0.zip', 'baz-1.0-py3-none-any.whl')
+    with Stubber(handler.ec2_client) as stubber:
+        stubber.add_response('run_instances', {})
+        stubber.add_response('run_instances', {})
+        result = handler.vend.function('foo bar baz', bucketname='packages')
+        stubber.assert_no_pending_responses()
+
+    assert result['artifacts'] == [
+        'bar/bar-2.0.zip', 'baz/baz-1.0-py3-none-any.whl', 'foo/foo-1.0.tar.gz',
+    ]
+
+
+def test_vend_launch_error(monkeypatch):
+    """Test vend raises an error from launching a build."""
+    fake_vend_io(monkeypatch, 'foo-1.0.tar.gz')
+    with Stubber(handler.ec2_client) as stubber:
+        stubber.add_client_error('run_instances', 'InstanceLimitExceeded')
+        with pytest.raises(ClientError):
+            handler.vend.function('foo', bucketname='packages')
+
+
+def test_download_requirements(monkeypatch):
+    """Test requirements are resolved together by a single pip run."""
+    calls = []
+    monkeypatch.setattr(handler, 'run_pip', calls.append)
+    handler.download_requirements(['a', 'c<3'], '/cache', '/dest')
+    assert calls == [['download', '--cache-dir', '/cache', '--dest', '/dest', 'a', 'c<3']]
+
+
+def make_artifacts(tmpdir, *filenames):
+    """Create artifact files in tmpdir."""
+    artifacts = []
+    for filename in filenames:
+        path = tmpdir.join(filename)
+        path.write('data')
+        artifacts.append(handler.PackageArtifact(str(path)))
+
+    return artifacts
+
+
+@contextlib.contextmanager
+def record_s3_params(operation):
+    """Record the parameters of each call to an S3 client operation."""
+    event = 'before-parameter-build.s3.' + operation
+    calls = []
+
+    def record(params, **kw):
+        calls.append(dict(params))
+
+    handler.s3_client.meta.events.register(event, record)
+    try:
+        yield calls
+    finally:
+        handler.s3_client.meta.events.unregister(event, record)
+
+
+def test_package_artifact_key():
+    """Test artifact keys are prefixed with the distribution."""
+    artifact = handler.PackageArtifact('/tmp/dl/typing_extensions-3.6.2.1-py3-none-any.whl')
+    assert artifact.key == 'typing-extensions/typing_extensions-3.6.2.1-py3-none-any.whl'
+
+
+@requires_conditional_put
+def test_upload_artifacts(tmpdir, monkeypatch):
+    """Test artifacts are deduped, listed keys skipped and the rest uploaded."""
+    monkeypatch.setattr(handler, 'supports_conditional_put', lambda s3: True)
+    artifacts = make_artifacts(tmpdir, 'foo-1.0.tar.gz', 'foo-1.0-py3-none-any.whl')
+    artifacts.extend(make_artifacts(tmpdir.mkdir('again'), 'foo-1.0-py3-none-any.whl'))
+    with Stubber(handler.s3_client) as stubber:
+        stubber.add_response(
+            'list_objects_v2',
+            {'Contents': [{'Key': 'foo/foo-1.0.tar.gz'}]},
+            {'Bucket': 'packages', 'Prefix': 'foo/'},
+        )
+        stubber.add_response(
+            'put_object',
+            {},
+            {'Bucket': 'packages', 'Key': 'foo/foo-1.0-py3-none-any.whl', 'Body': ANY, 'IfNoneMatch': '*'},
+        )
+        uploaded = handler.upload_artifacts(artifacts, 'packages', max_workers=1)
+        keys = sorted(key for key, _ in uploaded)
+        stubber.assert_no_pending_responses()
+
+    assert keys == ['foo/foo-1.0-py3-none-any.whl', 'foo/foo-1.0.tar.gz']
+
+
+def test_upload_artifacts_without_conditional_put(tmpdir, monkeypatch):
+    """Test listed keys are skipped and the rest uploaded without conditional PUT."""
+    monkeypatch.setattr(handler, 'supports_conditional_put', lambda s3: False)
+    artifacts = make_artifacts(tmpdir, 'foo-1.0.tar.gz', 'foo-1.0-py3-none-any.whl')
+    artifacts.extend(make_artifacts(tmpdir.mkdir('again'), 'foo-1.0-py3-none-any.whl'))
+    with Stubber(handler.s3_client) as stubber, record_s3_params('PutObject') as puts:
+        stubber.add_response(
+            'list_objects_v2',
+            {'Contents': [{'Key': 'foo/foo-1.0.tar.gz'}]},
+            {'Bucket': 'packages', 'Prefix': 'foo/'},
+        )
+        # The transfer manager adds parameters that vary between versions.
+        stubber.add_response('put_object', {})
+        uploaded = handler.upload_artifacts(artifacts, 'packages', max_workers=1)
+        keys = sorted(key for key, _ in uploaded)
+        stubber.assert_no_pending_responses()
+
+    assert keys == ['foo/foo-1.0-py3-none-any.whl', 'foo/foo-1.0.tar.gz']
+    assert [put['Key'] for put in puts] == ['foo/foo-1.0-py3-none-any.whl']
+    assert 'IfNoneMatch' not in puts[0]
+
+
+def test_proxy_call_args():
+    """Test proxy builds function args from the event."""
+    calls = []
+
+    def function(*args, **kwargs):
+        calls.append((args, kwargs))
+        return {'ok': True}
+
+    proxy = handler.apiproxy(function, routes=())
+    response = proxy({
+        'resource': '/test/{path+}',
+        'pathParameters': {'path': 'a/b', 'key': 'path'},
+        'queryStringParameters': {'query': 'string', 'key': 'query'},
+        'body': '{"body": 1, "key": "body"}',
+    }, None)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == {'ok': True}
+    assert calls.pop() == (('a', 'b'), {'body': 1, 'query': 'string', 'key': 'path'})
+
+    proxy({
+        'resource': '/test',
+        'pathParameters': None,
+        'queryStringParameters': None,
+        'body': None,
+    }, None)
+    assert calls.pop() == ((), {})
+
+
+def test_proxy_call_plain_param():
+    """Test a path parameter without + is passed whole, as a keyword."""
+    calls = []
+    proxy = handler.apiproxy(lambda *a, **kw: calls.append((a, kw)), routes=())
+    proxy({
+        'resource': '/test/{name}',
+        'pathParameters': {'name': 'a/b'},
+        'queryStringParameters': None,
+        'body': None,
+    }, None)
+    assert calls == [((), {'name': 'a/b'})]
+
+
+def test_proxy_call_errors():
+    """Test proxy turns exceptions into error responses."""
+    def api_error():
+        raise handler.APIError(400, 'Bad request')
+
+    def server_error():
+        raise RuntimeError('Unexpected')
+
+    event = {'resource': '/test', 'pathParameters': None, 'queryStringParameters': None, 'body': None}
+    response = handler.apiproxy(api_error, routes=())(dict(event), None)
+    assert response['statusCode'] == 400
+    assert json.loads(response['body']) == {'message': 'Bad request'}
+
+    response = handler.apiproxy(server_error, routes=())(dict(event), None)
+    assert response['statusCode'] == 500
+    assert 'RuntimeError: Unexpected' in json.loads(response['body'])['message']
+
+
+@requires_conditional_put
+def test_upload_artifact_exists(tmpdir, monkeypatch):
+    """Test a conditional PUT refused because the key exists is not an error."""
+    monkeypatch.setattr(handler, 'supports_conditional_put', lambda s3: True)
+    artifact, = make_artifacts(tmpdir, 'foo-1.0.tar.gz')
+    with Stubber(handler.s3_client) as stubber:
+        stubber.add_client_error('put_object', 'PreconditionFailed', http_status_code=412)
+        assert handler.upload_artifact(artifact, 'packages') == 'foo/foo-1.0.tar.gz'
+        stubber.assert_no_pending_responses()
+
+
+def test_upload_artifact_without_conditional_put(tmpdir, monkeypatch):
+    """Test existence is checked first when conditional PUT is unsupported."""
+    monkeypatch.setattr(handler, 'supports_conditional_put', lambda s3: False)
+    artifact, = make_artifacts(tmpdir, 'foo-1.0.tar.gz')
+    with Stubber(handler.s3_client) as stubber:
+        stubber.add_response('head_object', {}, {'Bucket': 'packages', 'Key': 'foo/foo-1.0.tar.gz'})
+        handler.upload_artifact(artifact, 'packages')
+        stubber.add_client_error('head_object', '404', http_status_code=404)
+        stubber.add_response('put_object', {})
+        handler.upload_artifact(artifact, 'packages')
+        stubber.assert_no_pending_responses()
@@ -1,7 +1,13 @@
 """Tests for vendor.service module."""
+import datetime
 import json
 import os.path
 
+import boto3
+from botocore.stub import ANY, Stubber
+from packaging import version
+import pytest
+
 from vendor import service
 
 
@@ -21,3 +27,111 @@ def test_parse_stack_outputs():
         'ServiceURL': 'https://abcdef1234.execute-api.region.amazonaws.com/api/',
     }
     assert output == expected
+
+
+def test_shared_cloudformation_client(monkeypatch):
+    """Test VendorService instances share a default CloudFormation client."""
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(service, '_cloudformation_client', None)
+    assert service.VendorService().client is service.VendorService().client
+
+
+class FakeCloudFormation(object):
+    """Minimal stand-in for a boto3 CloudFormation client."""
+
+    def __init__(self):
+        """Create new fake client."""
+        self.calls = []
+
+    def describe_stacks(self, **kw):
+        """Record call, returning the example Vendor stack description."""
+        self.calls.append(('describe_stacks', kw))
+        with open(data_filepath('describe-stacks-vendor.json')) as fp:
+            return json.load(fp)
+
+    def validate_template(self, **kw):
+        """Record call, returning a template with a Version parameter."""
+        self.calls.append(('validate_template', kw))
+        return {'Parameters': [{'ParameterKey': 'Version', 'DefaultValue': '1.0'}]}
+
+
+def test_versions_cached():
+    """Test deployment and service versions are only read once."""
+    client = FakeCloudFormation()
+    vs = service.VendorService(client)
+    assert vs._get_deployment_version() == version.Version('1.0')
+    assert vs._get_deployment_version() == version.Version('1.0')
+    assert len(client.calls) == 1
+    assert vs._get_service_version() is vs._get_service_version()
+
+
+def test_deploy_stack_create():
+    """Test deploy_stack creates a missing stack through a change set."""
+    client = boto3.client('cloudformation', region_name='us-east-1')
+    vs = service.VendorService(client)
+    with Stubber(client) as stubber:
+        stubber.add_client_error(
+            'describe_stacks',
+            service_message='Stack with id Vendor-deployment does not exist',
+        )
+        stubber.add_response(
+            'create_change_set',
+            {'Id': 'change-set-id', 'StackId': 'stack-id'},
+            {
+                'StackName': 'Vendor-deployment',
+                'TemplateBody': ANY,
+                'Parameters': [],
+                'Capabilities': [],
+                'ChangeSetName': ANY,
+                'ChangeSetType': 'CREATE',
+            },
+        )
+        stubber.add_response(
+            'describe_change_set',
+            {'Status': 'CREATE_COMPLETE'},
+            {'ChangeSetName': 'change-set-id'},
+        )
+        stubber.add_response(
+            'execute_change_set', {}, {'ChangeSetName': 'change-set-id'},
+        )
+        stubber.add_response(
+            'describe_stacks',
+            {'Stacks': [{
+                'StackName': 'Vendor-deployment',
+                'CreationTime': datetime.datetime(2018, 1, 1),
+                'StackStatus': 'CREATE_COMPLETE',
+            }]},
+            {'StackName': 'Vendor-deployment'},
+        )
+        vs.deploy_stack('Vendor-deployment', vs.deployment_template)
+        stubber.assert_no_pending_responses()
+
+
+def test_read_service_version(tmpdir):
+    """Test service version is read from the handler's __version__."""
+    index = tmpdir.join('handler.py')
+    index.write('"""Docstring."""\n__version__ = \'1.2.dev3\'\n\nimport os\n')
+    vs = service.VendorService(FakeCloudFormation())
+    vs.service_index = str(index)
+    assert vs._get_service_version() == version.Version('1.2.dev3')
+
+
+def test_describe_stack_cache(monkeypatch):
+    """Test stack descriptions are cached until they expire."""
+    client = FakeCloudFormation()
+    vs = service.VendorService(client)
+    assert vs.describe_stack('Vendor') is vs.describe_stack('Vendor')
+    assert len(client.calls) == 1
+    monkeypatch.setattr(service, 'DESCRIBE_CACHE_TTL', 0)
+    vs._describe_cache.clear()
+    vs.describe_stack('Vendor')
+    vs.describe_stack('Vendor')
+    assert len(client.calls) == 3
+
+
+def test_check_stack_parameters():
+    """Test a stack is outdated when a required parameter differs."""
+    vs = service.VendorService(FakeCloudFormation())
+    assert vs.check_stack('Vendor', parameters={'BucketName': ''})
+    with pytest.raises(service.StackOutdated):
+        vs.check_stack('Vendor', parameters={'BuildProxyAmiId': 'ami-12345678'})